@@ -1,7 +1,16 @@
 import modal
+import io
 import os
+import sys
+import json
 import logging
 import argparse
+import subprocess
+
+import vad_utils
+import parallel_transcribe
+import artifact_store
+from backends import make_backend
 
 # --- Basic Setup ---
 app = modal.App("video-subtitler-word-by-word")
@@ -17,26 +26,213 @@ image = (
         "sed -i 's/none/read,write/g' /etc/ImageMagick-6/policy.xml",
         "python3 -m pip install git+https://github.com/linto-ai/whisper-timestamped.git",
     )
+    .add_local_python_source("vad_utils", "backends", "parallel_transcribe", "artifact_store")
 )
 
 # --- Define a Persistent Shared Volume and Mount Path ---
-volume = modal.NetworkFileSystem.from_name("subtitling-volume", create_if_missing=True)
+# The volume itself is resolved by the execution backend (Modal NFS or a local directory).
+VOLUME_NAME = "subtitling-volume"
 REMOTE_MOUNT_PATH = "/data"
 
+# --- Span-Copy Configuration ---
+# Words closer than this (in seconds) are rendered as one re-encoded span.
+SUBTITLE_SPAN_GAP = 1.0
+# Above this share of subtitled time, splitting the video saves too little to be worth it.
+MAX_SUBTITLED_FRACTION = 0.9
+
+
+def _probe_video(video_path):
+    """Returns the codec, pixel format, frame rate and duration of the first video stream."""
+    probe_cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,pix_fmt,avg_frame_rate:format=duration",
+        "-of", "json", video_path,
+    ]
+    info = json.loads(subprocess.run(probe_cmd, check=True, capture_output=True, text=True).stdout)
+    stream = info["streams"][0]
+    num, den = stream["avg_frame_rate"].split("/")
+    return {
+        "codec": stream["codec_name"],
+        "pix_fmt": stream["pix_fmt"],
+        "fps": float(num) / float(den),
+        "duration": float(info["format"]["duration"]),
+    }
+
+
+def _keyframe_times(video_path):
+    """Returns the presentation times of all keyframes in the first video stream."""
+    probe_cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path,
+    ]
+    output = subprocess.run(probe_cmd, check=True, capture_output=True, text=True).stdout
+    times = []
+    for line in output.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            times.append(float(pts))
+    return sorted(times)
+
+
+def _snap_to_keyframes(spans, keyframes, duration):
+    """Widens each span outwards to keyframe boundaries so the gaps can be stream-copied."""
+    snapped = []
+    for start, end in spans:
+        snapped_start = max([k for k in keyframes if k <= start], default=0.0)
+        snapped_end = min([k for k in keyframes if k >= end], default=duration)
+        snapped.append((snapped_start, snapped_end))
+    return vad_utils.merge_spans(snapped)
+
+
+def _to_annexb_ts(input_path, output_path, start=None, duration=None):
+    """
+    Stream-copies the video of `input_path` into an Annex-B MPEG-TS segment.
+
+    Unlike MP4, where SPS/PPS live once in the avcC box, every TS segment carries
+    its own parameter sets in-band, so segments encoded with different x264
+    settings can be concatenated without re-encoding.
+    """
+    cmd = ["ffmpeg", "-y"]
+    if start is not None:
+        cmd += ["-ss", f"{start:.6f}"]
+    cmd += ["-i", input_path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-map", "0:v:0", "-c", "copy", "-bsf:v", "h264_mp4toannexb", "-f", "mpegts", output_path]
+    subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return output_path
+
+
+def _decodes_cleanly(video_path):
+    """Fully decodes the video and returns False if ffmpeg reports any error."""
+    check = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", video_path, "-f", "null", "-"],
+        capture_output=True, text=True,
+    )
+    return check.returncode == 0 and not check.stderr.strip()
+
+
+def _write_span_copied_video(video_path, word_clips, output_path, work_dir):
+    """
+    Re-encodes only the subtitled spans of the video and stream-copies the rest.
+
+    Returns False (leaving no output behind) when the source cannot be safely
+    concatenated with re-encoded segments, when there is too little to copy, or
+    when the concatenated result does not decode cleanly.
+    """
+    from moviepy.editor import VideoFileClip, CompositeVideoClip
+
+    info = _probe_video(video_path)
+    if info["codec"] != "h264" or info["pix_fmt"] != "yuv420p":
+        logger.info(f"Source is {info['codec']}/{info['pix_fmt']}; span copying needs h264/yuv420p.")
+        return False
+    duration = info["duration"]
+    spans = vad_utils.merge_spans(
+        [(clip.start, clip.end) for clip in word_clips], max_gap=SUBTITLE_SPAN_GAP
+    )
+    spans = _snap_to_keyframes(spans, _keyframe_times(video_path), duration)
+    subtitled_time = sum(end - start for start, end in spans)
+    if not spans or subtitled_time >= MAX_SUBTITLED_FRACTION * duration:
+        logger.info(f"{subtitled_time:.1f}s of {duration:.1f}s is subtitled; re-encoding the whole video.")
+        return False
+
+    logger.info(f"Re-encoding {len(spans)} subtitled spans ({subtitled_time:.1f}s of {duration:.1f}s); "
+                f"stream-copying the rest.")
+    os.makedirs(work_dir, exist_ok=True)
+    source_clip = VideoFileClip(video_path, audio=False)
+    segments = []
+    timeline = vad_utils.build_timeline(spans, duration)
+    for idx, (start, end, is_subtitled) in enumerate(timeline):
+        segment_path = os.path.join(work_dir, f"segment_{idx:04d}.ts")
+        if is_subtitled:
+            words = [
+                clip.set_start(clip.start - start)
+                for clip in word_clips
+                if clip.end > start and clip.start < end
+            ]
+            segment = CompositeVideoClip([source_clip.subclip(start, end)] + words).set_duration(end - start)
+            encoded_path = os.path.join(work_dir, f"segment_{idx:04d}.mp4")
+            segment.write_videofile(encoded_path, codec="libx264", audio=False, fps=info["fps"], logger=None)
+            _to_annexb_ts(encoded_path, segment_path)
+        else:
+            _to_annexb_ts(video_path, segment_path, start=start, duration=end - start)
+        segments.append(segment_path)
+    source_clip.close()
+
+    list_path = os.path.join(work_dir, "segments.txt")
+    with open(list_path, "w") as f:
+        for segment_path in segments:
+            f.write(f"file '{os.path.abspath(segment_path)}'\n")
+    subprocess.run(
+        ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-i", video_path,
+         "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy", "-c:a", "aac", output_path],
+        check=True, capture_output=True, text=True,
+    )
+    if not _decodes_cleanly(output_path):
+        logger.warning("Span-copied video does not decode cleanly; re-encoding the whole video instead.")
+        os.remove(output_path)
+        return False
+    return True
+
 
 # --- Define the "bare" logic as a global function ---
-def _add_subtitles_remote(input_filename, output_filename, whisper_model_name):
-    """This remote function creates a word-by-word subtitle animation."""
+def _add_subtitles_remote(input_filename, output_filename, whisper_model_name, copy_silent_spans=False,
+                          mount_path=REMOTE_MOUNT_PATH, transcribe_workers=1, transcribe_threads=1, job_id=None,
+                          quota_gb=artifact_store.DEFAULT_QUOTA_GB):
+    """
+    This remote function creates a word-by-word subtitle animation.
+
+    With `copy_silent_spans`, only the spans that carry subtitles are re-encoded;
+    the rest of the video is stream-copied at the source frame rate.
+
+    `mount_path` is where the shared volume is visible to this function.
+
+    With `transcribe_workers` > 1, the audio is split at silences and the chunks are
+    transcribed in parallel, each worker holding its own Whisper model.
+
+    With a `job_id`, the job's artifacts are leased while it runs and the volume is
+    trimmed to `quota_gb` afterwards. The lease is kept on success so the client can
+    download the result; it is dropped right away if subtitling fails.
+    """
+    video_path_remote = os.path.join(mount_path, input_filename)
+    output_path_remote = os.path.join(mount_path, output_filename)
+    if job_id is None:
+        _subtitle_video(video_path_remote, output_path_remote, whisper_model_name, copy_silent_spans,
+                        transcribe_workers, transcribe_threads)
+        return output_filename
+
+    store = artifact_store.ArtifactStore(mount_path, quota_bytes=quota_gb * 1024 ** 3)
+    store.acquire(job_id)
+    try:
+        _subtitle_video(video_path_remote, output_path_remote, whisper_model_name, copy_silent_spans,
+                        transcribe_workers, transcribe_threads)
+    except Exception:
+        store.release(job_id)
+        raise
+    store.touch(job_id)
+    store.gc()
+    return output_filename
+
+
+def _subtitle_video(video_path_remote, output_path_remote, whisper_model_name, copy_silent_spans,
+                    transcribe_workers, transcribe_threads):
+    """Transcribes the video and writes it with word-by-word subtitles burned in."""
     import whisper_timestamped as whisper
     from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
 
-    video_path_remote = os.path.join(REMOTE_MOUNT_PATH, input_filename)
     logger.info(f"--- Starting word-by-word subtitling for {video_path_remote} ---")
 
-    logger.info(f"Loading whisper-timestamped model '{whisper_model_name}'...")
-    model = whisper.load_model(whisper_model_name, device="cpu")
-    logger.info(f"Starting word-level transcription...")
-    result = whisper.transcribe(model, video_path_remote, language="en")
+    if transcribe_workers > 1:
+        logger.info(f"Starting chunked word-level transcription with '{whisper_model_name}'...")
+        result = parallel_transcribe.transcribe_parallel(
+            video_path_remote, whisper_model_name, transcribe_workers,
+            threads_per_worker=transcribe_threads, language="en", device="cpu",
+        )
+    else:
+        logger.info(f"Loading whisper-timestamped model '{whisper_model_name}'...")
+        model = whisper.load_model(whisper_model_name, device="cpu")
+        logger.info(f"Starting word-level transcription...")
+        result = whisper.transcribe(model, video_path_remote, language="en")
 
     logger.info("Transcription complete. Creating word-level TextClips...")
     all_word_clips = []
@@ -68,14 +264,19 @@ def _add_subtitles_remote(input_filename, output_filename, whisper_model_name):
             
             all_word_clips.append(word_clip)
 
+    os.makedirs(os.path.dirname(output_path_remote), exist_ok=True)
+
+    if copy_silent_spans and all_word_clips:
+        logger.info("Writing subtitled spans and copying the rest of the video...")
+        if _write_span_copied_video(video_path_remote, all_word_clips, output_path_remote, work_dir="span_segments"):
+            return
+
     logger.info("Compositing all word clips onto the original video...")
     original_video_clip = VideoFileClip(video_path_remote)
     
     final_clip = CompositeVideoClip([original_video_clip] + all_word_clips)
 
-    output_path_remote = os.path.join(REMOTE_MOUNT_PATH, output_filename)
     logger.info(f"Writing final video to {output_path_remote}...")
-    os.makedirs(os.path.dirname(output_path_remote), exist_ok=True)
     
     final_clip.write_videofile(
         output_path_remote, 
@@ -85,46 +286,79 @@ def _add_subtitles_remote(input_filename, output_filename, whisper_model_name):
         remove_temp=True,
         fps=24
     )
-    
-    return output_filename
 
 
 @app.local_entrypoint()
 def main():
     """This local entrypoint handles file uploads, function calls, and downloads."""
-    # This function's logic is correct and does not need to change.
+    # 'add_subtitles_modal.py gc ...' trims the shared volume instead of subtitling.
+    if sys.argv[1:2] == ["gc"]:
+        _collect_garbage(sys.argv[2:])
+        return
     parser = argparse.ArgumentParser(description="Add word-by-word subtitles to a video using Whisper on Modal.")
     parser.add_argument("--input-video", required=True, help="Path to the local video file you want to subtitle.")
     parser.add_argument("--output-video", default="output_with_word_subs.mp4", help="Filename for the final subtitled video.")
     parser.add_argument("--gpu", default="T4", help="GPU type to use on Modal (e.g., T4, A10G, H100).")
     parser.add_argument("--model", default="base", help="Whisper model size (e.g., tiny, base, small, medium, large).")
+    parser.add_argument("--copy-silent-spans", action="store_true", help="Only re-encode the spans that carry subtitles and stream-copy the rest (keeps the source frame rate).")
+    parser.add_argument("--backend", default="modal", choices=["modal", "local"], help="Where to run the subtitler: on Modal, or in a local worker process (CPU only).")
+    parser.add_argument("--transcribe-workers", type=int, default=None, help="Number of parallel Whisper workers, each loading its own model (default: 1 on Modal, one per local CPU with --backend local).")
+    parser.add_argument("--transcribe-threads", type=int, default=1, help="Torch threads per Whisper worker when --transcribe-workers > 1.")
+    parser.add_argument("--quota-gb", type=float, default=artifact_store.DEFAULT_QUOTA_GB, help="Size quota of the shared volume; least recently used jobs are evicted after each run.")
     args = parser.parse_args()
 
+    if args.transcribe_workers is None:
+        # On the local machine os.cpu_count() is accurate; in a container it reports the
+        # host's cores, so Modal runs only get the CPUs that were asked for.
+        args.transcribe_workers = (os.cpu_count() or 1) if args.backend == "local" else 1
+    if args.transcribe_workers < 1 or args.transcribe_threads < 1:
+        parser.error("--transcribe-workers and --transcribe-threads must be at least 1.")
+    transcribe_workers = args.transcribe_workers
+    transcribe_threads = args.transcribe_threads
+
+    backend = make_backend(args.backend, app)
+    volume, mount_path = backend.network_file_system(VOLUME_NAME, REMOTE_MOUNT_PATH)
+
     local_path = args.input_video
     if not os.path.exists(local_path):
         logger.error(f"Input file not found at: {local_path}")
         return
 
-    input_filename = os.path.basename(local_path)
+    # Every run gets its own namespace, so same-named uploads never overwrite each other.
+    job_id = artifact_store.new_job_id()
+    input_filename = artifact_store.job_path(job_id, "input", os.path.basename(local_path))
+    output_filename = artifact_store.job_path(job_id, "output", os.path.basename(args.output_video))
+    lease_path = f"/{artifact_store.job_path(job_id, artifact_store.LEASE_FILE)}"
     remote_path = f"/{input_filename}"
-    
+
+    # Lease the job before uploading so a concurrent GC cannot evict the input.
+    volume.write_file(lease_path, io.BytesIO(artifact_store.lease_bytes()))
     logger.info(f"Uploading '{local_path}' to the shared volume at path '{remote_path}'...")
     with open(local_path, "rb") as local_file_handle:
         volume.write_file(remote_path, local_file_handle)
     logger.info("Upload complete.")
 
-    add_subtitles = app.function(
+    add_subtitles = backend.function(
+        _add_subtitles_remote,
         image=image,
         gpu=args.gpu,
+        # Reserve the cores the transcription pool is sized for.
+        cpu=float(transcribe_workers * transcribe_threads),
         network_file_systems={REMOTE_MOUNT_PATH: volume},
         timeout=1800,
-    )(_add_subtitles_remote)
+    )
 
-    with app.run():
+    with backend.run():
         final_video_relative_path = add_subtitles.remote(
             input_filename=input_filename,
-            output_filename=args.output_video,
-            whisper_model_name=args.model
+            output_filename=output_filename,
+            whisper_model_name=args.model,
+            copy_silent_spans=args.copy_silent_spans,
+            mount_path=mount_path,
+            transcribe_workers=transcribe_workers,
+            transcribe_threads=transcribe_threads,
+            job_id=job_id,
+            quota_gb=args.quota_gb,
         )
 
     logger.info(f"Downloading final video from volume path '{final_video_relative_path}' to local path '{args.output_video}'...")
@@ -138,8 +372,49 @@ def main():
         
     with open(args.output_video, "wb") as local_f:
         local_f.write(video_bytes)
+
+    # The result is safe locally; the job may now be evicted like any other.
+    volume.remove_file(lease_path)
             
     logger.info(f"✅ Success! Your subtitled video is saved at '{args.output_video}'")
 
+
+def _gc_remote(mount_path=REMOTE_MOUNT_PATH, quota_gb=artifact_store.DEFAULT_QUOTA_GB, dry_run=False):
+    """This remote function evicts least recently used jobs from the shared volume."""
+    store = artifact_store.ArtifactStore(mount_path, quota_bytes=quota_gb * 1024 ** 3)
+    # Unlike the automatic pass after each run, a manual gc also trims files left
+    # at the volume root by older versions.
+    return store.gc(dry_run=dry_run, include_legacy=True)
+
+
+def _collect_garbage(argv):
+    """Trims the shared volume to its quota and reports what was reclaimed (the 'gc' subcommand)."""
+    parser = argparse.ArgumentParser(prog="add_subtitles_modal.py gc", description="Evict least recently used jobs from the subtitling volume.")
+    parser.add_argument("--quota-gb", type=float, default=artifact_store.DEFAULT_QUOTA_GB, help="Size the volume is trimmed down to.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be evicted.")
+    parser.add_argument("--backend", default="modal", choices=["modal", "local"], help="Trim the Modal volume or the local one.")
+    args = parser.parse_args(argv)
+
+    backend = make_backend(args.backend, app)
+    volume, mount_path = backend.network_file_system(VOLUME_NAME, REMOTE_MOUNT_PATH)
+    run_gc = backend.function(
+        _gc_remote,
+        image=image,
+        network_file_systems={REMOTE_MOUNT_PATH: volume},
+        timeout=600,
+    )
+
+    with backend.run():
+        report = run_gc.remote(mount_path=mount_path, quota_gb=args.quota_gb, dry_run=args.dry_run)
+
+    action = "Would evict" if report["dry_run"] else "Evicted"
+    for entry in report["evicted"]:
+        logger.info(f"{action} '{entry['name']}' ({entry['bytes'] / 1024 ** 2:.1f} MiB)")
+    logger.info(
+        f"{action} {len(report['evicted'])} entries, reclaiming {report['reclaimed_bytes'] / 1024 ** 3:.2f} GB; "
+        f"{report['remaining_bytes'] / 1024 ** 3:.2f} GB of {report['quota_bytes'] / 1024 ** 3:.2f} GB quota in use."
+    )
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
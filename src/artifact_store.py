@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+import contextlib
+
+# --- Configuration ---
+JOBS_DIR = "jobs"
+LOCK_FILE = "_gc.lock"
+LEASE_FILE = ".lease"
+ACCESS_FILE = ".last_access"
+DEFAULT_QUOTA_GB = 20.0
+# A job is protected from eviction until its lease expires; the client renews it
+# on upload and drops it after downloading the result.
+DEFAULT_LEASE_SECONDS = 2 * 60 * 60
+
+logger = logging.getLogger("artifact_store")
+
+
+def new_job_id():
+    """Returns a sortable, collision-free job id (e.g. 20250614-172615-1a2b3c4d)."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def job_path(job_id, *parts):
+    """Returns the volume-relative path of an artifact inside a job's namespace."""
+    return "/".join([JOBS_DIR, job_id, *parts])
+
+
+def lease_bytes(seconds=DEFAULT_LEASE_SECONDS):
+    """Returns the content of a lease file that expires `seconds` from now."""
+    return json.dumps({"expires_at": time.time() + seconds}).encode()
+
+
+def _write_atomic(path, data):
+    """Writes data to a uniquely named temp file and renames it into place."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            # The few bytes of lease and access bookkeeping do not count towards the quota.
+            if name.startswith((LEASE_FILE, ACCESS_FILE)):
+                continue
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+class ArtifactStore:
+    """
+    Per-job namespaces, access times and a size quota on top of a mounted volume.
+
+    Every job records its own last access in jobs/<id>/.last_access, so writers
+    never share a file; a Modal NetworkFileSystem offers no cross-container
+    locking. Jobs are evicted as a whole, least recently used first. Jobs
+    holding an unexpired lease are never evicted. Files left at the volume root
+    by older versions are tracked by their modification time and are only
+    evicted when gc is asked to include them.
+    """
+
+    def __init__(self, root, quota_bytes=DEFAULT_QUOTA_GB * 1024 ** 3):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        os.makedirs(os.path.join(root, JOBS_DIR), exist_ok=True)
+
+    def path(self, relative_path):
+        return os.path.join(self.root, relative_path)
+
+    @contextlib.contextmanager
+    def _gc_lock(self):
+        """
+        Serializes gc runs on a best-effort basis.
+
+        flock only excludes processes on the same host; gc runs in different
+        containers may overlap, which is harmless since eviction tolerates
+        entries that vanish and job state lives in per-job files.
+        """
+        with open(self.path(LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def touch(self, job_id, timestamp=None):
+        """Records an access to a job (now, unless `timestamp` is given)."""
+        os.makedirs(self.path(job_path(job_id)), exist_ok=True)
+        last_access = time.time() if timestamp is None else timestamp
+        _write_atomic(self.path(job_path(job_id, ACCESS_FILE)), json.dumps({"last_access": last_access}).encode())
+
+    def acquire(self, job_id, seconds=DEFAULT_LEASE_SECONDS):
+        """Marks a job as in use so that eviction skips it."""
+        os.makedirs(self.path(job_path(job_id)), exist_ok=True)
+        with open(self.path(job_path(job_id, LEASE_FILE)), "wb") as f:
+            f.write(lease_bytes(seconds))
+        self.touch(job_id)
+
+    def release(self, job_id):
+        """Drops a job's lease and records the access."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path(job_path(job_id, LEASE_FILE)))
+        self.touch(job_id)
+
+    def _is_leased(self, job_id, now):
+        try:
+            with open(self.path(job_path(job_id, LEASE_FILE))) as f:
+                return json.load(f)["expires_at"] > now
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _last_access(self, job_id, job_dir):
+        """Returns a job's recorded last access, falling back to its directory's mtime."""
+        try:
+            with open(self.path(job_path(job_id, ACCESS_FILE))) as f:
+                return json.load(f)["last_access"]
+        except (OSError, ValueError, KeyError):
+            return os.path.getmtime(job_dir)
+
+    def _entries(self, include_legacy=False):
+        """
+        Returns every evictable unit as (name, path, size, last_access, leased).
+
+        Files at the volume root are only included with `include_legacy`.
+
+        Clients upload and remove files while gc runs, so entries that
+        disappear during the scan are skipped.
+        """
+        now = time.time()
+        entries = []
+        jobs_root = self.path(JOBS_DIR)
+        for job_id in os.listdir(jobs_root):
+            job_dir = os.path.join(jobs_root, job_id)
+            try:
+                last_access = self._last_access(job_id, job_dir)
+            except OSError:
+                continue
+            entries.append((job_id, job_dir, _dir_size(job_dir), last_access, self._is_leased(job_id, now)))
+        if not include_legacy:
+            return entries
+        for name in os.listdir(self.root):
+            if name in (JOBS_DIR, LOCK_FILE):
+                continue
+            legacy_path = self.path(name)
+            try:
+                size = _dir_size(legacy_path) if os.path.isdir(legacy_path) else os.path.getsize(legacy_path)
+                last_access = os.path.getmtime(legacy_path)
+            except OSError:
+                continue
+            entries.append((name, legacy_path, size, last_access, False))
+        return entries
+
+    def gc(self, quota_bytes=None, dry_run=False, include_legacy=False):
+        """
+        Evicts least recently used, unleased jobs until the volume fits the quota.
+
+        Only jobs/ is considered unless `include_legacy` is set; then files left
+        at the volume root count against the quota and may be evicted too.
+
+        Returns a report dict with the evicted entries and the reclaimed bytes.
+        """
+        quota_bytes = self.quota_bytes if quota_bytes is None else quota_bytes
+        evicted = []
+        with self._gc_lock():
+            entries = self._entries(include_legacy=include_legacy)
+            total_bytes = sum(entry[2] for entry in entries)
+            remaining = total_bytes
+            for name, entry_path, size, last_access, leased in sorted(entries, key=lambda e: e[3]):
+                if remaining <= quota_bytes:
+                    break
+                if leased:
+                    continue
+                if not dry_run:
+                    if os.path.isdir(entry_path):
+                        shutil.rmtree(entry_path, ignore_errors=True)
+                    else:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(entry_path)
+                evicted.append({"name": name, "bytes": size, "last_access": last_access})
+                remaining -= size
+        report = {
+            "total_bytes": total_bytes,
+            "quota_bytes": quota_bytes,
+            "reclaimed_bytes": total_bytes - remaining,
+            "remaining_bytes": remaining,
+            "evicted": evicted,
+            "dry_run": dry_run,
+        }
+        logger.info(f"GC {'(dry run) ' if dry_run else ''}reclaimed {report['reclaimed_bytes'] / 1024 ** 2:.1f} MiB "
+                    f"from {len(evicted)} entries; {remaining / 1024 ** 2:.1f} MiB remain.")
+        return report
@@ -0,0 +1,143 @@
+import os
+import shutil
+import logging
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Configuration ---
+REMOTE_PROJECT_ROOT = "/project"
+REMOTE_HELPER_DIR = "/root"
+LOCAL_HELPER_DIR = os.path.join("src", "helper")
+LOCAL_VOLUME_ROOT = ".volumes"
+LOCAL_WORK_DIR = ".work"
+READ_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger("backends")
+
+
+class ModalBackend:
+    """Runs stage functions remotely as Modal functions."""
+
+    name = "modal"
+
+    def __init__(self, app):
+        self.app = app
+        self.helper_dir = REMOTE_HELPER_DIR
+
+    def project_path(self, relative_path):
+        """Maps a path relative to the project root to where the stage function sees it."""
+        return f"{REMOTE_PROJECT_ROOT}/{relative_path}"
+
+    def network_file_system(self, name, mount_path):
+        """Returns (volume, mount_path) for a shared volume, creating it if needed."""
+        import modal
+
+        return modal.NetworkFileSystem.from_name(name, create_if_missing=True), mount_path
+
+    def function(self, fn, **options):
+        """Wraps a stage function; options are passed to app.function (image, gpu, ...)."""
+        return self.app.function(**options)(fn)
+
+    def run(self):
+        return self.app.run()
+
+
+class LocalVolume:
+    """A local directory with the read_file/write_file/remove_file API of modal.NetworkFileSystem."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def write_file(self, remote_path, fp):
+        local_path = self._path(remote_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as f:
+            shutil.copyfileobj(fp, f)
+
+    def read_file(self, remote_path):
+        with open(self._path(remote_path), "rb") as f:
+            while chunk := f.read(READ_CHUNK_SIZE):
+                yield chunk
+
+    def remove_file(self, remote_path, recursive=False):
+        local_path = self._path(remote_path)
+        if recursive and os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+        else:
+            os.remove(local_path)
+
+
+def _call_in_dir(fn, work_dir, kwargs):
+    """Runs fn inside work_dir and restores the worker's cwd, since stages may os.chdir()."""
+    previous_dir = os.getcwd()
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    try:
+        return fn(**kwargs)
+    finally:
+        os.chdir(previous_dir)
+
+
+class LocalFunction:
+    """Mimics a Modal function handle by submitting calls to the backend's process pool."""
+
+    def __init__(self, backend, fn):
+        self.backend = backend
+        self.fn = fn
+
+    def remote(self, **kwargs):
+        return self.spawn(**kwargs).result()
+
+    def spawn(self, **kwargs):
+        """Submits the call without waiting and returns a concurrent.futures.Future."""
+        if self.backend.executor is None:
+            raise RuntimeError("LocalBackend functions can only be called inside 'with backend.run():'.")
+        return self.backend.executor.submit(_call_in_dir, self.fn, self.backend.work_dir, kwargs)
+
+
+class LocalBackend:
+    """Runs stage functions in a local worker process, using local paths for /project and volumes."""
+
+    name = "local"
+
+    def __init__(self, project_root=".", max_workers=None):
+        self.project_root = os.path.abspath(project_root)
+        self.helper_dir = os.path.join(self.project_root, LOCAL_HELPER_DIR)
+        self.work_dir = os.path.join(self.project_root, LOCAL_WORK_DIR)
+        # Each entry point makes a single stage call; the stages parallelize internally.
+        self.max_workers = max_workers or 1
+        self.executor = None
+
+    def project_path(self, relative_path):
+        return os.path.join(self.project_root, relative_path)
+
+    def network_file_system(self, name, mount_path):
+        volume = LocalVolume(os.path.join(self.project_root, LOCAL_VOLUME_ROOT, name))
+        return volume, volume.root
+
+    def function(self, fn, **options):
+        # Container options (image, gpu, timeout, ...) have no local equivalent.
+        return LocalFunction(self, fn)
+
+    @contextlib.contextmanager
+    def run(self):
+        logger.info(f"Running stages locally on up to {self.max_workers} worker processes.")
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            self.executor = executor
+            try:
+                yield self
+            finally:
+                self.executor = None
+
+
+def make_backend(name, app, max_workers=None):
+    """Returns the execution backend selected on the command line."""
+    if name == "modal":
+        return ModalBackend(app)
+    if name == "local":
+        return LocalBackend(max_workers=max_workers)
+    raise ValueError(f"Unknown backend '{name}'. Use 'modal' or 'local'.")
@@ -4,7 +4,8 @@ import os
 
 print("--- Applying runtime patch to use local HuBERT model and processor ---")
 
-file_to_patch = "/workspace/Real3DPortrait/data_gen/utils/process_audio/extract_hubert.py"
+# An explicit path can be passed for checkouts outside /workspace (e.g. the local backend).
+file_to_patch = sys.argv[1] if len(sys.argv) > 1 else "/workspace/Real3DPortrait/data_gen/utils/process_audio/extract_hubert.py"
 
 if not os.path.exists(file_to_patch):
     print(f"Error: Could not find file to patch at {file_to_patch}", file=sys.stderr)
@@ -0,0 +1,41 @@
+import fileinput
+import sys
+import os
+
+print("--- Applying runtime patch to hook real3d_accel into Real3D-Portrait inference ---")
+
+# An explicit path can be passed for checkouts outside /workspace (e.g. the local backend).
+file_to_patch = sys.argv[1] if len(sys.argv) > 1 else "/workspace/Real3DPortrait/inference/real3d_infer.py"
+# real3d_accel.py is shipped next to this script.
+accel_dir = os.path.dirname(os.path.abspath(__file__))
+
+if not os.path.exists(file_to_patch):
+    print(f"Error: Could not find file to patch at {file_to_patch}", file=sys.stderr)
+    sys.exit(1)
+
+# The hook runs at the top of the script's __main__ block, after GeneFace2Infer is defined
+# but before any model is built, so real3d_accel can wrap the class in place.
+main_guards = ("if __name__ == '__main__':", 'if __name__ == "__main__":')
+hook_line = f'    import sys; sys.path.insert(0, "{accel_dir}"); import real3d_accel; real3d_accel.install(globals())\n'
+
+with open(file_to_patch) as f:
+    if "real3d_accel" in f.read():
+        print("Patch not needed. The hook is already installed.")
+        sys.exit(0)
+
+try:
+    patched = False
+    with fileinput.FileInput(file_to_patch, inplace=True) as file:
+        for line in file:
+            print(line, end="")
+            if not patched and line.strip() in main_guards:
+                print(hook_line, end="")
+                patched = True
+    if not patched:
+        print("Error: Could not find the __main__ block to hook into.", file=sys.stderr)
+        sys.exit(1)
+    print("--- Patching complete for real3d_accel hook. ---")
+
+except Exception as e:
+    print(f"An unexpected error occurred during patching: {e}", file=sys.stderr)
+    sys.exit(1)
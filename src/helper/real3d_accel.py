@@ -0,0 +1,202 @@
+# real3d_accel.py
+#
+# Runtime acceleration hooks for Real3D-Portrait's inference/real3d_infer.py.
+# patch_real3d_accel.py injects a call to install(globals()) at the top of the
+# script's __main__ block. Everything is configured through environment variables
+# so the script's own command line stays untouched:
+#
+#   REAL3D_PRECISION  fp32 (default) | bf16 | fp16
+#   REAL3D_COMPILE    none (default) | default | reduce-overhead | max-autotune
+#   REAL3D_MODULES    comma-separated GeneFace2Infer attributes to accelerate
+#                     (default: secc2video_model, the per-frame renderer)
+#   REAL3D_IDENTITIES JSON list of {"src_img", "bg_img", "out_name"} dicts; every
+#                     identity is rendered from the same audio/pose in one process
+import functools
+import json
+import os
+
+import torch
+
+DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+DEFAULT_MODULES = "secc2video_model"
+# GeneFace2Infer methods that extract audio features from the 16 kHz driving wav;
+# their results only depend on that path, so they are shared across identities.
+AUDIO_FEATURE_METHODS = ("get_hubert", "get_f0")
+# GeneFace2Infer attribute of the audio-to-motion model. Its expression sequence
+# only depends on the driving audio, so it is predicted once per infer_once call.
+AUDIO2SECC_MODULE = "audio2secc_model"
+# Keys of real3d_infer.py's `inp` dict that differ between identities.
+IDENTITY_KEYS = {"src_img": "src_image_name", "bg_img": "bg_image_name", "out_name": "out_name"}
+
+
+def _map_tensors(obj, fn):
+    """Applies fn to every tensor in a (nested) model output."""
+    if torch.is_tensor(obj):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return type(obj)((k, _map_tensors(v, fn)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_map_tensors(v, fn) for v in obj)
+    return obj
+
+
+def _to_fp32(obj):
+    """Casts every floating-point tensor in a (nested) model output back to fp32."""
+    return _map_tensors(obj, lambda t: t.float() if t.is_floating_point() else t)
+
+
+def _clone(obj):
+    """Copies every tensor in a (nested) model output so callers can modify it freely."""
+    return _map_tensors(obj, torch.clone)
+
+
+def _accelerate_module(module, dtype, compile_mode):
+    """Replaces module.forward with an autocast and/or torch.compile'd version."""
+    forward = module.forward
+    if compile_mode != "none":
+        # "reduce-overhead" captures the renderer into CUDA graphs.
+        forward = torch.compile(forward, mode=None if compile_mode == "default" else compile_mode)
+
+    uses_cuda_graphs = compile_mode == "reduce-overhead"
+
+    @functools.wraps(module.forward)
+    def accelerated_forward(*args, **kwargs):
+        if uses_cuda_graphs:
+            # Each call is a new step; without this the graph reuses the buffers of
+            # outputs the caller still holds (e.g. frames collected across a batch).
+            torch.compiler.cudagraph_mark_step_begin()
+        if dtype is None:
+            out = forward(*args, **kwargs)
+        else:
+            with torch.autocast(device_type="cuda", dtype=dtype):
+                out = forward(*args, **kwargs)
+            # Downstream code converts frames with .numpy(), which does not support bf16.
+            out = _to_fp32(out)
+        # CUDA graph outputs are overwritten by the next replay, so hand out copies.
+        return _clone(out) if uses_cuda_graphs else out
+
+    module.forward = accelerated_forward
+
+
+def _memoize_by_path(fn):
+    """Caches fn's result per (hashable) arguments, e.g. the driving audio's path."""
+    cache = {}
+
+    @functools.wraps(fn)
+    def cached(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return fn(*args, **kwargs)
+        if key not in cache:
+            cache[key] = fn(*args, **kwargs)
+        return cache[key]
+
+    return cached
+
+
+def _share_forward(module):
+    """
+    Makes module.forward run once and replay its output (and `ret` dict) on later calls.
+
+    Returns a callable that restores the original forward.
+    """
+    forward = module.forward
+    cache = {}
+
+    @functools.wraps(forward)
+    def shared_forward(*args, ret=None, **kwargs):
+        if not cache:
+            cache["out"] = forward(*args, ret=ret, **kwargs)
+            cache["ret"] = _clone(dict(ret)) if ret is not None else None
+        elif ret is not None and cache["ret"] is not None:
+            ret.update(_clone(cache["ret"]))
+        return _clone(cache["out"])
+
+    module.forward = shared_forward
+
+    def restore():
+        module.forward = forward
+
+    return restore
+
+
+def _install_multi_identity(infer_cls, identities):
+    """Makes one infer_once call render every identity on the already loaded models."""
+    for name in AUDIO_FEATURE_METHODS:
+        if callable(getattr(infer_cls, name, None)):
+            setattr(infer_cls, name, _memoize_by_path(getattr(infer_cls, name)))
+        else:
+            print(f"[real3d_accel] Warning: GeneFace2Infer.{name} not found; it runs once per identity.")
+    original_infer_once = infer_cls.infer_once
+
+    @functools.wraps(original_infer_once)
+    def infer_all(self, inp, *args, **kwargs):
+        missing = [key for key in IDENTITY_KEYS.values() if key not in inp]
+        if missing:
+            raise KeyError(f"[real3d_accel] infer_once input has no {missing}; cannot switch identities.")
+        audio2secc = getattr(self, AUDIO2SECC_MODULE, None)
+        if isinstance(audio2secc, torch.nn.Module):
+            restore = _share_forward(audio2secc)
+        else:
+            print(f"[real3d_accel] Warning: '{AUDIO2SECC_MODULE}' is not a module on GeneFace2Infer; "
+                  f"audio-to-motion runs once per identity.")
+            restore = None
+        results = []
+        try:
+            for idx, identity in enumerate(identities):
+                print(f"[real3d_accel] Rendering identity {idx + 1}/{len(identities)}: {identity['out_name']}")
+                identity_inp = dict(inp, **{IDENTITY_KEYS[key]: value for key, value in identity.items()})
+                results.append(original_infer_once(self, identity_inp, *args, **kwargs))
+        finally:
+            if restore is not None:
+                restore()
+        return results[0]
+
+    infer_cls.infer_once = infer_all
+
+
+def install(namespace):
+    """Wraps GeneFace2Infer according to the REAL3D_* environment variables."""
+    precision = os.getenv("REAL3D_PRECISION", "fp32")
+    compile_mode = os.getenv("REAL3D_COMPILE", "none")
+    module_names = [m.strip() for m in os.getenv("REAL3D_MODULES", DEFAULT_MODULES).split(",") if m.strip()]
+    identities = json.loads(os.getenv("REAL3D_IDENTITIES", "[]"))
+    if precision not in DTYPES and precision != "fp32":
+        raise ValueError(f"Unsupported REAL3D_PRECISION '{precision}'. Use one of: fp32, {', '.join(DTYPES)}.")
+
+    infer_cls = namespace.get("GeneFace2Infer")
+    if infer_cls is None:
+        print("[real3d_accel] Warning: GeneFace2Infer not found; running unmodified.")
+        return
+
+    if len(identities) > 1:
+        print(f"[real3d_accel] Rendering {len(identities)} identities with shared models and audio-driven motion.")
+        _install_multi_identity(infer_cls, identities)
+    if precision == "fp32" and compile_mode == "none":
+        return
+
+    print(f"[real3d_accel] precision={precision}, compile={compile_mode}, modules={module_names}")
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    if compile_mode != "none":
+        import torch._dynamo
+        # Fall back to eager for anything the compiler cannot handle instead of failing the render.
+        torch._dynamo.config.suppress_errors = True
+
+    dtype = DTYPES.get(precision)
+    original_init = infer_cls.__init__
+
+    @functools.wraps(original_init)
+    def accelerated_init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        for name in module_names:
+            module = getattr(self, name, None)
+            if isinstance(module, torch.nn.Module):
+                _accelerate_module(module, dtype, compile_mode)
+            else:
+                print(f"[real3d_accel] Warning: '{name}' is not a module on GeneFace2Infer; skipping.")
+
+    infer_cls.__init__ = accelerated_init
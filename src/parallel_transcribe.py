@@ -0,0 +1,172 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import vad_utils
+
+# --- Configuration ---
+# Chunks are cut in the middle of a silence once they reach this length.
+TARGET_CHUNK_SECONDS = 30.0
+# Under a full beat the VAD rarely finds a silence, so longer chunks are force-cut
+# at their quietest frame between TARGET_CHUNK_SECONDS and this length.
+MAX_CHUNK_SECONDS = 45.0
+# Frame length used to find the quietest cut point.
+ENERGY_FRAME_SECONDS = 0.03
+# Audio added on both sides of a chunk so words at the cut keep their context.
+CHUNK_PADDING_SECONDS = 0.5
+# Two words with the same text starting closer than this are treated as one.
+DUPLICATE_WORD_TOLERANCE = 0.1
+
+logger = logging.getLogger("parallel_transcribe")
+
+# Loaded once per worker process by _init_worker.
+_MODEL = None
+
+
+def plan_chunks(vocal_spans, duration, target_seconds=TARGET_CHUNK_SECONDS, max_seconds=MAX_CHUNK_SECONDS,
+                quietest=None):
+    """
+    Splits [0, duration] into consecutive (start, end) chunks cut at silence midpoints.
+
+    A chunk is closed at the first silence after it has reached `target_seconds`.
+    Any chunk still longer than `max_seconds` is force-cut at `quietest(lo, hi)`,
+    the quietest time in [start + target_seconds, start + max_seconds]
+    (or at start + target_seconds without a `quietest` callable).
+    """
+    cuts = []
+    chunk_start = 0.0
+    for (_, prev_end), (next_start, _) in zip(vocal_spans, vocal_spans[1:]):
+        cut = (prev_end + next_start) / 2.0
+        if cut - chunk_start >= target_seconds:
+            cuts.append(cut)
+            chunk_start = cut
+
+    chunks = []
+    chunk_start = 0.0
+    for cut in cuts + [duration]:
+        while cut - chunk_start > max_seconds:
+            lo, hi = chunk_start + target_seconds, chunk_start + max_seconds
+            forced = quietest(lo, hi) if quietest else lo
+            chunks.append((chunk_start, forced))
+            chunk_start = forced
+        chunks.append((chunk_start, cut))
+        chunk_start = cut
+    return chunks
+
+
+def _quietest_time(samples, sample_rate, frame_seconds=ENERGY_FRAME_SECONDS):
+    """Returns quietest(lo, hi) giving the start time of the lowest-energy frame in [lo, hi)."""
+    import numpy as np
+
+    frame_len = max(1, int(frame_seconds * sample_rate))
+    num_frames = len(samples) // frame_len
+    energy = np.square(samples[:num_frames * frame_len].reshape(num_frames, frame_len)).mean(axis=1)
+
+    def quietest(lo, hi):
+        first = int(lo / frame_seconds)
+        last = min(num_frames, max(first + 1, int(hi / frame_seconds)))
+        if first >= num_frames:
+            return lo
+        return (first + int(np.argmin(energy[first:last]))) * frame_seconds
+
+    return quietest
+
+
+def _init_worker(model_name, device, num_threads):
+    """Loads the Whisper model once per worker process."""
+    global _MODEL
+    import torch
+    import whisper_timestamped as whisper
+
+    # Keep workers from oversubscribing the cores they share.
+    torch.set_num_threads(num_threads)
+    _MODEL = whisper.load_model(model_name, device=device)
+
+
+def _transcribe_chunk(audio, offset, core_start, core_end, language):
+    """
+    Transcribes one padded chunk and returns its segments on the global timeline.
+
+    Only words whose midpoint falls inside [core_start, core_end) are kept, so a
+    word transcribed in the padding of two neighbouring chunks is kept only once.
+    """
+    import whisper_timestamped as whisper
+
+    result = whisper.transcribe(_MODEL, audio, language=language)
+    segments = []
+    for segment in result["segments"]:
+        words = []
+        for word_info in segment["words"]:
+            start = word_info["start"] + offset
+            end = word_info["end"] + offset
+            if core_start <= (start + end) / 2.0 < core_end:
+                words.append(dict(word_info, start=start, end=end))
+        if words:
+            segments.append(dict(segment, start=words[0]["start"], end=words[-1]["end"], words=words))
+    return segments
+
+
+def _dedupe_words(segments):
+    """Drops words that repeat the previous word's text at (almost) the same time."""
+    previous = None
+    for segment in segments:
+        kept = []
+        for word_info in segment["words"]:
+            if (
+                previous is not None
+                and word_info["text"].strip().lower() == previous["text"].strip().lower()
+                and abs(word_info["start"] - previous["start"]) < DUPLICATE_WORD_TOLERANCE
+            ):
+                continue
+            kept.append(word_info)
+            previous = word_info
+        segment["words"] = kept
+    return [segment for segment in segments if segment["words"]]
+
+
+def transcribe_parallel(audio_path, model_name, num_workers, threads_per_worker=1, language="en", device="cpu"):
+    """
+    Transcribes `audio_path` with one Whisper model per worker process.
+
+    The caller sizes the pool explicitly: inside a container, os.cpu_count()
+    reports the host's cores rather than the CPUs reserved for the function.
+
+    Returns a whisper-timestamped style result ({"segments": [{"words": [...]}]})
+    with all timestamps on the global timeline.
+    """
+    import numpy as np
+
+    # Decode once to 16 kHz mono; both the VAD pass and Whisper read this copy.
+    wav_path = vad_utils.extract_wav(audio_path, os.path.join("vad_tmp", "whisper_16k.wav"))
+    vocal_spans, duration = vad_utils.detect_vocal_spans(wav_path)
+
+    pcm, sample_rate = vad_utils.read_pcm(wav_path)
+    # Whisper expects float32 samples in [-1, 1].
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+    chunks = plan_chunks(vocal_spans, duration, quietest=_quietest_time(samples, sample_rate))
+    num_workers = max(1, min(num_workers, len(chunks)))
+    logger.info(f"Transcribing {len(chunks)} chunks of ~{TARGET_CHUNK_SECONDS:.0f}s on {num_workers} workers "
+                f"with {threads_per_worker} threads each...")
+
+    # 'spawn' avoids forking a process that may already hold torch thread pools.
+    context = multiprocessing.get_context("spawn")
+    futures = []
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(model_name, device, threads_per_worker),
+    ) as executor:
+        for core_start, core_end in chunks:
+            padded_start = max(0.0, core_start - CHUNK_PADDING_SECONDS)
+            padded_end = min(duration, core_end + CHUNK_PADDING_SECONDS)
+            audio = samples[int(padded_start * sample_rate):int(padded_end * sample_rate)]
+            futures.append(
+                executor.submit(_transcribe_chunk, audio, padded_start, core_start, core_end, language)
+            )
+        segments = [segment for future in futures for segment in future.result()]
+
+    segments.sort(key=lambda segment: segment["start"])
+    return {"segments": _dedupe_words(segments)}
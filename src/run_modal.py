@@ -6,6 +6,11 @@ import glob
 import zipfile
 import logging
 import argparse
+import json
+import math
+
+import vad_utils
+from backends import REMOTE_HELPER_DIR, make_backend
 
 # --- Basic Setup (Logger and App) ---
 modal.enable_output()
@@ -20,92 +25,486 @@ if not logger.handlers:
 
 app = modal.App("real3d-portrait")
 
+# --- Preview Defaults ---
+PREVIEW_SIZE = 256
+PREVIEW_FPS = 12
+PREVIEW_GPU = "T4"
+# Length of the preview window when --preview-end is not given.
+PREVIEW_SECONDS = 10.0
+# The image is built with TORCH_CUDA_ARCH_LIST=9.0 for the H100, and Real3D JIT-compiles
+# its EG3D custom ops (bias_act, upfirdn2d, filtered_lrelu) against that list.
+# Previews run on cheaper GPUs, so they need kernels for those architectures too.
+PREVIEW_CUDA_ARCH_LIST = "7.5;8.0;8.6;8.9;9.0"
+
+# --- Silence-Skipping Defaults ---
+# Below this share of non-vocal audio, compacting the inputs is not worth the extra ffmpeg passes.
+MIN_SILENT_FRACTION = 0.05
+# Non-vocal spans are filled by ping-ponging this much rendered video next to the gap.
+IDLE_LOOP_SECONDS = 1.0
+
+# --- Optimized Inference Defaults ---
+ACCEL_PRECISION = "bf16"
+ACCEL_COMPILE = "reduce-overhead"
+LPIPS_THRESHOLD = 0.05
+LPIPS_MAX_FRAMES = 64
+
+
+def _trim_media(input_path, output_path, start=None, end=None):
+    """Cuts the [start, end) window (in seconds) out of an audio or video file with ffmpeg."""
+    cmd = ["ffmpeg", "-y"]
+    if start is not None:
+        cmd += ["-ss", str(start)]
+    cmd += ["-i", input_path]
+    if end is not None:
+        cmd += ["-t", str(end - (start or 0))]
+    cmd.append(output_path)
+    subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return output_path
+
+
+def _downscale_video(input_path, output_path, size, fps):
+    """Re-encodes a video so that its longest side is `size` pixels at `fps` frames per second."""
+    scale = f"scale='if(gt(iw,ih),{size},-2)':'if(gt(iw,ih),-2,{size})'"
+    cmd = [
+        "ffmpeg", "-y", "-i", input_path,
+        "-vf", f"{scale},fps={fps}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+        "-c:a", "aac", output_path,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return output_path
+
+
+def _prepare_preview_inputs(drv_aud, drv_pose, start, end, work_dir="preview_inputs"):
+    """Trims the driving audio and pose video to the requested preview window."""
+    if start is None and end is None:
+        return drv_aud, drv_pose
+    os.makedirs(work_dir, exist_ok=True)
+    aud_out = os.path.join(work_dir, os.path.basename(drv_aud))
+    pose_out = os.path.join(work_dir, os.path.basename(drv_pose))
+    return _trim_media(drv_aud, aud_out, start, end), _trim_media(drv_pose, pose_out, start, end)
+
+
+def _probe_fps(video_path):
+    """Returns the average frame rate of the first video stream."""
+    probe_cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=avg_frame_rate", "-of", "json", video_path,
+    ]
+    result = subprocess.run(probe_cmd, check=True, capture_output=True, text=True)
+    num, den = json.loads(result.stdout)["streams"][0]["avg_frame_rate"].split("/")
+    return float(num) / float(den)
+
+
+def _probe_frame_count(video_path):
+    """Returns the number of frames in the first video stream (by counting packets)."""
+    probe_cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets", "-of", "json", video_path,
+    ]
+    result = subprocess.run(probe_cmd, check=True, capture_output=True, text=True)
+    return int(json.loads(result.stdout)["streams"][0]["nb_read_packets"])
+
+
+def _snap_to_frames(spans, fps, duration):
+    """Widens spans to whole frames of the pose video and returns them as (first, end) frame indices."""
+    last = int(math.floor(duration * fps))
+    frames = [(int(math.floor(start * fps)), min(last, int(math.ceil(end * fps)))) for start, end in spans]
+    return [(first, end) for first, end in vad_utils.merge_spans(frames) if end > first]
+
+
+def _compact_to_spans(drv_aud, drv_pose, spans, duration, work_dir="vocal_inputs"):
+    """
+    Concatenates only the vocal spans of the driving audio and pose video.
+
+    The spans are snapped to the pose video's frame grid and cut with trim/atrim,
+    so audio and video keep exactly the same length. Returns the compacted audio
+    and pose paths and the snapped spans in seconds.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    fps = _probe_fps(drv_pose)
+    frame_spans = _snap_to_frames(spans, fps, duration)
+    audio_filters, video_filters = [], []
+    for idx, (first, end) in enumerate(frame_spans):
+        audio_filters.append(
+            f"[0:a]atrim=start={first / fps:.6f}:end={end / fps:.6f},asetpts=PTS-STARTPTS[a{idx}]"
+        )
+        video_filters.append(f"[0:v]trim=start_frame={first}:end_frame={end},setpts=PTS-STARTPTS[v{idx}]")
+    num_spans = len(frame_spans)
+    audio_filters.append("".join(f"[a{idx}]" for idx in range(num_spans)) + f"concat=n={num_spans}:v=0:a=1[a]")
+    video_filters.append("".join(f"[v{idx}]" for idx in range(num_spans)) + f"concat=n={num_spans}:v=1:a=0[v]")
+    aud_out = os.path.join(work_dir, os.path.basename(drv_aud))
+    pose_out = os.path.join(work_dir, os.path.basename(drv_pose))
+    subprocess.run(
+        ["ffmpeg", "-y", "-i", drv_aud, "-filter_complex", ";".join(audio_filters), "-map", "[a]", aud_out],
+        check=True, capture_output=True, text=True,
+    )
+    subprocess.run(
+        ["ffmpeg", "-y", "-i", drv_pose, "-filter_complex", ";".join(video_filters), "-map", "[v]", pose_out],
+        check=True, capture_output=True, text=True,
+    )
+    return aud_out, pose_out, [(first / fps, end / fps) for first, end in frame_spans]
+
+
+def _fill_silent_spans(rendered_path, timeline, full_audio, output_path):
+    """
+    Re-expands a video rendered from the vocal spans only back onto the full timeline.
+
+    Vocal spans are cut from the rendered video in order; every non-vocal span is
+    filled by playing the rendered frames next to it back and forth, so the idle
+    avatar keeps its head motion, and the original full-length audio is muxed
+    back on top.
+    """
+    fps = _probe_fps(rendered_path)
+    # Real3D may round the frame count down, so never point past the last rendered frame.
+    frame_count = max(1, _probe_frame_count(rendered_path))
+    loop_frames = max(1, int(round(IDLE_LOOP_SECONDS * fps)))
+    filters = []
+    cursor = 0.0
+    for idx, (start, end, is_vocal) in enumerate(timeline):
+        length = end - start
+        if is_vocal:
+            # Cut by frame index from the accumulated vocal time, so rounding never adds up.
+            first, cursor = int(round(cursor * fps)), cursor + length
+            filters.append(
+                f"[0:v]trim=start_frame={first}:end_frame={int(round(cursor * fps))},setpts=PTS-STARTPTS[s{idx}]"
+            )
+            continue
+        # Loop the frames leading up to the gap, starting backwards from the last one
+        # shown; a leading gap plays the first rendered frames forwards and back instead.
+        rendered_end = int(round(cursor * fps))
+        if rendered_end == 0:
+            clip_start, clip_end = 0, min(frame_count, loop_frames)
+        else:
+            clip_end = min(frame_count, rendered_end)
+            clip_start = max(0, clip_end - loop_frames)
+        cycle = 2 * (clip_end - clip_start)
+        loops = max(0, math.ceil(length * fps / cycle) - 1)
+        order = f"[f{idx}][r{idx}]" if rendered_end == 0 else f"[r{idx}][f{idx}]"
+        filters.append(
+            f"[0:v]trim=start_frame={clip_start}:end_frame={clip_end},setpts=PTS-STARTPTS,"
+            f"split[f{idx}][c{idx}]"
+        )
+        filters.append(f"[c{idx}]reverse[r{idx}]")
+        # Trim to the exact gap length; otherwise every gap drifts the video by a frame.
+        filters.append(
+            f"{order}concat=n=2:v=1:a=0,loop=loop={loops}:size={cycle}:start=0,"
+            f"setpts=N/({fps:.6f}*TB),trim=duration={length:.3f}[s{idx}]"
+        )
+    labels = "".join(f"[s{idx}]" for idx in range(len(timeline)))
+    filters.append(f"{labels}concat=n={len(timeline)}:v=1:a=0,fps={fps:g}[v]")
+    fill_cmd = [
+        "ffmpeg", "-y", "-i", rendered_path, "-i", full_audio,
+        "-filter_complex", ";".join(filters),
+        "-map", "[v]", "-map", "1:a:0", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", output_path,
+    ]
+    subprocess.run(fill_cmd, check=True, capture_output=True, text=True)
+    return output_path
+
+
+def _lpips_distance(reference_path, candidate_path, max_frames=LPIPS_MAX_FRAMES):
+    """Returns the mean LPIPS distance over evenly sampled frames of two equally long videos."""
+    import imageio
+    import lpips
+    import numpy as np
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    metric = lpips.LPIPS(net="alex").to(device)
+    ref_reader = imageio.get_reader(reference_path)
+    cand_reader = imageio.get_reader(candidate_path)
+    num_frames = min(ref_reader.count_frames(), cand_reader.count_frames())
+    indices = np.unique(np.linspace(0, num_frames - 1, min(max_frames, num_frames)).astype(int))
+
+    def to_tensor(frame):
+        # HWC uint8 -> 1CHW float in [-1, 1], as expected by LPIPS.
+        return torch.from_numpy(frame).permute(2, 0, 1)[None].float().div(127.5).sub(1.0).to(device)
+
+    distances = []
+    with torch.no_grad():
+        for idx in indices:
+            ref = to_tensor(ref_reader.get_data(int(idx)))
+            cand = to_tensor(cand_reader.get_data(int(idx)))
+            distances.append(metric(ref, cand).item())
+    ref_reader.close()
+    cand_reader.close()
+    return float(np.mean(distances))
+
+
+def _run_real3d(drv_aud, drv_pose, renders, out_mode, accel=None, cuda_arch_list=None):
+    """
+    Runs Real3D-Portrait inference, optionally with the real3d_accel hooks enabled.
+
+    `renders` is a list of {"src_img", "bg_img", "out_name"} dicts. With more than
+    one entry, all identities are rendered in a single process that loads the
+    models and extracts the audio features only once.
+
+    `cuda_arch_list` overrides TORCH_CUDA_ARCH_LIST for the JIT-compiled custom ops.
+    """
+    first = renders[0]
+    infer_cmd = [
+        "python", "inference/real3d_infer.py", "--src_img", first["src_img"], "--drv_aud", drv_aud,
+        "--drv_pose", drv_pose, "--bg_img", first["bg_img"], "--out_name", first["out_name"],
+        "--out_mode", out_mode,
+    ]
+    env = dict(os.environ)
+    if cuda_arch_list:
+        env["TORCH_CUDA_ARCH_LIST"] = cuda_arch_list
+    if len(renders) > 1:
+        env["REAL3D_IDENTITIES"] = json.dumps(renders)
+    if accel:
+        env["REAL3D_PRECISION"] = accel["precision"]
+        env["REAL3D_COMPILE"] = accel["compile"]
+    else:
+        # The H100 has memory to spare, but the accelerated path is opt-in.
+        infer_cmd.append("--low_memory_usage")
+    logging.getLogger("run_pipeline_remote").info(f"Running inference: {' '.join(infer_cmd)}")
+    subprocess.run(infer_cmd, check=True, env=env)
+    return [render["out_name"] for render in renders]
+
+
 # --- Define the "bare" logic as a global function ---
-def _run_pipeline_inner(src_img, drv_aud, drv_pose, bg_img, out_name):
-    """This is the internal implementation of the pipeline."""
-    # The body of this function is correct and does not need to change
+def _run_pipeline_inner(src_img, drv_aud, drv_pose, bg_img, out_name, preview=None, skip_silence=False, accel=None,
+                        helper_dir=REMOTE_HELPER_DIR, identities=None):
+    """
+    This is the internal implementation of the pipeline.
+
+    When `preview` is a dict with `size`, `fps`, `start` and `end` keys, only the
+    requested audio window is rendered (without the debug panels) and the result is
+    downscaled to a small draft video.
+
+    When `skip_silence` is set, a VAD pass finds the non-vocal spans of the driving
+    audio; only the vocal spans are rendered and the gaps are filled with idle frames.
+
+    When `accel` is a dict with `precision`, `compile` and `lpips_threshold` keys, the
+    renderer runs with autocast/torch.compile and without --low_memory_usage. A set
+    `lpips_threshold` renders without the debug panels, also renders an fp32
+    reference and fails if the optimized output drifts further than that from it.
+
+    `helper_dir` is where the patch scripts live (/root in the Modal image). Any
+    other directory means a local run, which skips the container-only setup steps.
+
+    When `identities` is a list of {"src_img", "bg_img", "out_name"} dicts, every
+    identity is driven by the same audio and pose in one inference run, and a dict
+    of {out_name: video bytes} is returned instead of the bytes of a single video.
+    """
     _logger = logging.getLogger("run_pipeline_remote")
     _logger.setLevel(logging.INFO)
     repo_url = "https://github.com/yerfor/Real3DPortrait.git"
-    subprocess.run(["git", "clone", repo_url, "Real3DPortrait"], check=True)
+    # A local working directory may already hold a checkout from an earlier run.
+    if not os.path.isdir("Real3DPortrait"):
+        subprocess.run(["git", "clone", repo_url, "Real3DPortrait"], check=True)
     os.chdir("Real3DPortrait")
-    _logger.info("Applying runtime patch to use local HuBERT model...")
-    subprocess.run(["python", "/root/patch_hubert_runtime.py"], check=True)
-    if os.path.exists("requirements.txt"):
+    # Only the Modal image bakes HuBERT into /models and is safe to pip install into;
+    # a local run loads HuBERT from the Hugging Face cache and uses the caller's environment.
+    in_container = helper_dir == REMOTE_HELPER_DIR
+    if in_container:
+        _logger.info("Applying runtime patch to use local HuBERT model...")
+        subprocess.run(["python", os.path.join(helper_dir, "patch_hubert_runtime.py"),
+                        os.path.abspath("data_gen/utils/process_audio/extract_hubert.py")], check=True)
+    renders = identities or [{"src_img": src_img, "bg_img": bg_img, "out_name": out_name}]
+    if accel or len(renders) > 1:
+        _logger.info("Applying runtime patch to hook the inference accelerator...")
+        subprocess.run(["python", os.path.join(helper_dir, "patch_real3d_accel.py"),
+                        os.path.abspath("inference/real3d_infer.py")], check=True)
+    if in_container and os.path.exists("requirements.txt"):
         _logger.info("Installing requirements.txt from the repo")
         subprocess.run(["pip", "install", "-r", "requirements.txt"], check=True)
     bfm_folder = "deep_3drecon/BFM"
     os.makedirs(bfm_folder, exist_ok=True)
-    _logger.info("Downloading BFM model files...")
-    subprocess.run(["gdown", "--folder", "1o4t5YIw7w4cMUN4bgU9nPf6IyWVG1bEk", "-O", bfm_folder], check=True)
+    if not os.listdir(bfm_folder):
+        _logger.info("Downloading BFM model files...")
+        subprocess.run(["gdown", "--folder", "1o4t5YIw7w4cMUN4bgU9nPf6IyWVG1bEk", "-O", bfm_folder], check=True)
     ckpt_folder = "checkpoints"
     os.makedirs(ckpt_folder, exist_ok=True)
-    _logger.info("Downloading pretrained checkpoints...")
-    subprocess.run(["gdown", "--folder", "1MAveJf7RvJ-Opg1f5qhLdoRoC_Gc6nD9", "-O", ckpt_folder], check=True)
-    for archive in glob.glob(os.path.join(ckpt_folder, "*.zip")):
-        _logger.info(f"Unzipping {archive}...")
-        with zipfile.ZipFile(archive, 'r') as z:
-            z.extractall(ckpt_folder)
-    infer_cmd = [
-        "python", "inference/real3d_infer.py", "--src_img", src_img, "--drv_aud", drv_aud,
-        "--drv_pose", drv_pose, "--bg_img", bg_img, "--out_name", out_name,
-        "--out_mode", "concat_debug", "--low_memory_usage",
-    ]
-    _logger.info(f"Running inference: {' '.join(infer_cmd)}")
-    subprocess.run(infer_cmd, check=True)
-    output_path = out_name
-    with open(output_path, "rb") as f:
-        return f.read()
+    if not os.listdir(ckpt_folder):
+        _logger.info("Downloading pretrained checkpoints...")
+        subprocess.run(["gdown", "--folder", "1MAveJf7RvJ-Opg1f5qhLdoRoC_Gc6nD9", "-O", ckpt_folder], check=True)
+        for archive in glob.glob(os.path.join(ckpt_folder, "*.zip")):
+            _logger.info(f"Unzipping {archive}...")
+            with zipfile.ZipFile(archive, 'r') as z:
+                z.extractall(ckpt_folder)
+    out_mode = "concat_debug"
+    if preview:
+        _logger.info(f"Preview mode: window={preview['start']}-{preview['end']}s, "
+                     f"size={preview['size']}px, fps={preview['fps']}")
+        drv_aud, drv_pose = _prepare_preview_inputs(drv_aud, drv_pose, preview["start"], preview["end"])
+        # The debug panels triple the rendering work and are not needed for a draft.
+        out_mode = "final"
+    timeline = None
+    full_aud = drv_aud
+    if skip_silence:
+        spans, duration = vad_utils.detect_vocal_spans(drv_aud)
+        silent_fraction = 1.0 - sum(e - s for s, e in spans) / duration if duration else 0.0
+        if spans and silent_fraction >= MIN_SILENT_FRACTION:
+            _logger.info(f"Skipping {silent_fraction:.0%} non-vocal audio; rendering {len(spans)} vocal spans.")
+            drv_aud, drv_pose, spans = _compact_to_spans(drv_aud, drv_pose, spans, duration)
+            timeline = vad_utils.build_timeline(spans, duration)
+        else:
+            _logger.info(f"Only {silent_fraction:.0%} non-vocal audio found; rendering the full track.")
+    quality_check = bool(accel) and accel.get("lpips_threshold") is not None
+    if quality_check:
+        # The debug panels show the unchanged source and driving frames, which would
+        # dilute the LPIPS distance; compare the rendered avatar only.
+        out_mode = "final"
+    cuda_arch_list = PREVIEW_CUDA_ARCH_LIST if preview else None
+    out_names = _run_real3d(drv_aud, drv_pose, renders, out_mode, accel=accel, cuda_arch_list=cuda_arch_list)
+    if quality_check:
+        _logger.info("Rendering fp32 reference for the quality check...")
+        reference_renders = [dict(render, out_name=f"reference_{render['out_name']}") for render in renders]
+        reference_names = _run_real3d(drv_aud, drv_pose, reference_renders, out_mode, cuda_arch_list=cuda_arch_list)
+        for name, reference_name in zip(out_names, reference_names):
+            distance = _lpips_distance(reference_name, name)
+            _logger.info(f"LPIPS of {name} vs. fp32 reference: {distance:.4f} (threshold {accel['lpips_threshold']})")
+            if distance > accel["lpips_threshold"]:
+                raise RuntimeError(
+                    f"Optimized render drifted from the fp32 reference (LPIPS {distance:.4f} > "
+                    f"{accel['lpips_threshold']}). Try --precision fp16 or fp32."
+                )
+    videos = {}
+    for name in out_names:
+        output_path = name
+        if timeline:
+            _logger.info(f"Filling non-vocal spans of {name} with idle frames...")
+            output_path = _fill_silent_spans(name, timeline, full_aud, f"filled_{name}")
+        if preview:
+            output_path = _downscale_video(output_path, f"preview_{name}", preview["size"], preview["fps"])
+        with open(output_path, "rb") as f:
+            videos[name] = f.read()
+    return videos if identities else videos[out_name]
 
 @app.local_entrypoint()
 def main():
     """This local entrypoint now builds the full Modal function dynamically."""
     parser = argparse.ArgumentParser(description="Run Real3DPortrait inference on Modal with custom data.")
-    parser.add_argument("--src-img", required=True, help="Path to the source image (e.g., data/raw/kendrick.png).")
+    parser.add_argument("--src-img", required=True, nargs="+", help="Path to the source image (e.g., data/raw/kendrick.png). Pass several to render multiple avatars in one run.")
     parser.add_argument("--drv-aud", required=True, help="Path to the driving audio (e.g., data/processed/audio.wav).")
     parser.add_argument("--drv-pose", required=True, help="Path to the driving pose video (e.g., data/processed/video.mp4).")
-    parser.add_argument("--bg-img", required=True, help="Path to the background image (e.g., data/raw/bg.png).")
+    parser.add_argument("--bg-img", required=True, nargs="+", help="Path to the background image (e.g., data/raw/bg.png). Pass one per --src-img, or a single one shared by all.")
     parser.add_argument("--out-name", default="output.mp4", help="Name of the output video file.")
+    parser.add_argument("--preview", action="store_true", help="Render a fast, low-resolution draft instead of the final video.")
+    parser.add_argument("--preview-size", type=int, default=PREVIEW_SIZE, help="Longest side (in pixels) of the preview video. Real3D still renders at full resolution; only the saved file is downscaled.")
+    parser.add_argument("--preview-fps", type=int, default=PREVIEW_FPS, help="Frame rate of the preview video. Real3D still renders every frame; only the saved file is resampled.")
+    parser.add_argument("--preview-start", type=float, default=0.0, help="Start of the preview window in seconds (default: 0).")
+    parser.add_argument("--preview-end", type=float, default=None, help=f"End of the preview window in seconds (default: --preview-start + {PREVIEW_SECONDS:g}).")
+    parser.add_argument("--preview-gpu", default=PREVIEW_GPU, help="GPU type for preview renders (e.g., T4, L4, A10G). Real3D needs CUDA, so a GPU is required.")
+    parser.add_argument("--skip-silence", action="store_true", help="Render only the vocal spans of the audio (found with VAD) and fill the gaps with idle frames.")
+    parser.add_argument("--optimized", action="store_true", help="Run the renderer with mixed precision and torch.compile, without --low_memory_usage.")
+    parser.add_argument("--precision", default=ACCEL_PRECISION, choices=["bf16", "fp16", "fp32"], help="Autocast precision for --optimized.")
+    parser.add_argument("--compile-mode", default=ACCEL_COMPILE, choices=["none", "default", "reduce-overhead", "max-autotune"], help="torch.compile mode for --optimized ('reduce-overhead' uses CUDA graphs).")
+    parser.add_argument("--quality-check", action="store_true", help="With --optimized, also render an fp32 reference and compare them with LPIPS. Both are rendered without the debug panels.")
+    parser.add_argument("--lpips-threshold", type=float, default=LPIPS_THRESHOLD, help="Maximum mean LPIPS distance allowed by --quality-check.")
+    parser.add_argument("--backend", default="modal", choices=["modal", "local"], help="Where to run the pipeline: on Modal, or in a local worker process (needs a local CUDA GPU and the Docker image's dependencies).")
     args = parser.parse_args()
 
+    preview = None
+    if args.preview:
+        if args.preview_end is None:
+            # The render time is set by the window length, so keep drafts short by default.
+            args.preview_end = args.preview_start + PREVIEW_SECONDS
+        if args.preview_end <= args.preview_start:
+            parser.error("--preview-end must be greater than --preview-start.")
+        preview = {
+            "size": args.preview_size,
+            "fps": args.preview_fps,
+            "start": args.preview_start,
+            "end": args.preview_end,
+        }
+
+    accel = None
+    if args.optimized:
+        accel = {
+            "precision": args.precision,
+            "compile": args.compile_mode,
+            "lpips_threshold": args.lpips_threshold if args.quality_check else None,
+        }
+    elif args.quality_check:
+        parser.error("--quality-check requires --optimized.")
+
+    num_identities = max(len(args.src_img), len(args.bg_img))
+    for flag, paths in (("--src-img", args.src_img), ("--bg-img", args.bg_img)):
+        if len(paths) not in (1, num_identities):
+            parser.error(f"{flag} takes either one path or {num_identities} paths.")
+    src_imgs = args.src_img * num_identities if len(args.src_img) == 1 else args.src_img
+    bg_imgs = args.bg_img * num_identities if len(args.bg_img) == 1 else args.bg_img
+    out_names = [args.out_name]
+    if num_identities > 1:
+        stem, ext = os.path.splitext(args.out_name)
+        out_names = [
+            f"{stem}_{os.path.splitext(os.path.basename(src))[0]}_{os.path.splitext(os.path.basename(bg))[0]}{ext}"
+            for src, bg in zip(src_imgs, bg_imgs)
+        ]
+        if len(set(out_names)) != len(out_names):
+            parser.error("Each --src-img/--bg-img pair must be unique.")
+
+    base_image = modal.Image.from_dockerfile("./Dockerfile")
+    if preview:
+        # Build steps must come before the add_local_* layers below.
+        base_image = base_image.env({"TORCH_CUDA_ARCH_LIST": PREVIEW_CUDA_ARCH_LIST})
     image = (
-        modal.Image.from_dockerfile("./Dockerfile")
+        base_image
         # [THE FIX] Correct path to the patch script using 'helper' (singular).
         .add_local_file("src/helper/patch_hubert_runtime.py", remote_path="/root/patch_hubert_runtime.py")
+        .add_local_file("src/helper/patch_real3d_accel.py", remote_path="/root/patch_real3d_accel.py")
+        .add_local_file("src/helper/real3d_accel.py", remote_path="/root/real3d_accel.py")
+        .add_local_python_source("vad_utils", "backends")
         # This mounts the entire project directory into the container.
         .add_local_dir(".", remote_path="/project")
     )
 
-    run_pipeline = app.function(
+    gpu = "H100"
+    if preview:
+        gpu = args.preview_gpu
+
+    # The quality check renders the clip twice; every extra identity adds one render.
+    timeout = (30 * 60 if args.quality_check else 15 * 60) * num_identities
+
+    backend = make_backend(args.backend, app)
+    run_pipeline = backend.function(
+        _run_pipeline_inner,
         image=image,
-        gpu="H100",
-        timeout=15 * 60,
+        gpu=gpu,
+        timeout=timeout,
         secrets=[modal.Secret.from_name("huggingface-secret")],
-    )(_run_pipeline_inner)
+    )
 
-    with app.run():
-        src_img_path = f"/project/{args.src_img}"
-        drv_aud_path = f"/project/{args.drv_aud}"
-        drv_pose_path = f"/project/{args.drv_pose}"
-        bg_img_path = f"/project/{args.bg_img}"
+    with backend.run():
+        drv_aud_path = backend.project_path(args.drv_aud)
+        drv_pose_path = backend.project_path(args.drv_pose)
+        identities = None
+        if num_identities > 1:
+            identities = [
+                {"src_img": backend.project_path(src), "bg_img": backend.project_path(bg), "out_name": name}
+                for src, bg, name in zip(src_imgs, bg_imgs, out_names)
+            ]
 
-        video_bytes = run_pipeline.remote(
-            src_img=src_img_path,
+        result = run_pipeline.remote(
+            src_img=backend.project_path(src_imgs[0]),
             drv_aud=drv_aud_path,
             drv_pose=drv_pose_path,
-            bg_img=bg_img_path,
-            out_name=args.out_name
+            bg_img=backend.project_path(bg_imgs[0]),
+            out_name=out_names[0],
+            preview=preview,
+            skip_silence=args.skip_silence,
+            accel=accel,
+            helper_dir=backend.helper_dir,
+            identities=identities,
         )
     
-    if video_bytes:
+    videos = result if identities else {out_names[0]: result}
+    for name in out_names:
+        video_bytes = videos.get(name)
+        if not video_bytes:
+            logger.error(f"❌ Pipeline did not return video bytes for {name}. Check logs for errors.")
+            continue
         output_dir = "output"
         os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, args.out_name)
+        out_name = f"preview_{name}" if preview else name
+        output_path = os.path.join(output_dir, out_name)
         with open(output_path, "wb") as out_file:
             out_file.write(video_bytes)
         logger.info(f"✅ Success! Saved output video to {output_path}")
-    else:
-        logger.error("❌ Pipeline did not return video bytes. Check logs for errors.")
 
 if __name__ == "__main__":
     main()
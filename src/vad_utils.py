@@ -0,0 +1,111 @@
+import os
+import subprocess
+import wave
+import logging
+
+# --- Configuration ---
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+SUPPORTED_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+
+logger = logging.getLogger("vad_utils")
+
+
+def extract_wav(input_path, output_path, sample_rate=VAD_SAMPLE_RATE):
+    """Converts any audio/video file to the mono 16-bit PCM WAV format expected by webrtcvad."""
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    convert_cmd = [
+        "ffmpeg", "-y", "-i", input_path, "-vn",
+        "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), output_path,
+    ]
+    subprocess.run(convert_cmd, check=True, capture_output=True, text=True)
+    return output_path
+
+
+def read_pcm(wav_path):
+    """Reads a WAV file and returns (pcm_bytes, sample_rate), or None if webrtcvad cannot use it."""
+    with wave.open(wav_path, "rb") as wf:
+        if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() not in SUPPORTED_SAMPLE_RATES:
+            return None
+        return wf.readframes(wf.getnframes()), wf.getframerate()
+
+
+def load_pcm(audio_path, work_dir="vad_tmp"):
+    """Returns (pcm_bytes, sample_rate) for any audio/video file, converting it first if needed."""
+    if audio_path.lower().endswith(".wav"):
+        pcm = read_pcm(audio_path)
+        if pcm is not None:
+            return pcm
+    base, _ = os.path.splitext(os.path.basename(audio_path))
+    wav_path = extract_wav(audio_path, os.path.join(work_dir, f"{base}_vad.wav"))
+    return read_pcm(wav_path)
+
+
+def merge_spans(spans, max_gap=0.0):
+    """Sorts spans and merges those that overlap or are separated by at most `max_gap` seconds."""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def complement_spans(spans, duration):
+    """Returns the gaps between `spans` inside [0, duration]."""
+    gaps = []
+    cursor = 0.0
+    for start, end in spans:
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < duration:
+        gaps.append((cursor, duration))
+    return gaps
+
+
+def build_timeline(spans, duration):
+    """Returns the whole [0, duration] range as ordered (start, end, is_vocal) entries."""
+    timeline = [(s, e, True) for s, e in spans] + [(s, e, False) for s, e in complement_spans(spans, duration)]
+    return sorted(timeline)
+
+
+def detect_vocal_spans(audio_path, aggressiveness=2, min_silence=0.6, min_vocal=0.2, padding=0.15):
+    """
+    Runs webrtcvad over the audio and returns (vocal_spans, duration) in seconds.
+
+    Silences shorter than `min_silence` are bridged, vocal bursts shorter than
+    `min_vocal` are dropped, and every span is padded by `padding` seconds so
+    that word onsets and releases are not clipped.
+    """
+    import webrtcvad
+
+    pcm, sample_rate = load_pcm(audio_path)
+    vad = webrtcvad.Vad(aggressiveness)
+    frame_bytes = int(sample_rate * VAD_FRAME_MS / 1000) * 2
+    frame_sec = VAD_FRAME_MS / 1000.0
+    duration = len(pcm) / 2 / sample_rate
+
+    raw_spans = []
+    span_start = None
+    for i in range(len(pcm) // frame_bytes):
+        frame = pcm[i * frame_bytes:(i + 1) * frame_bytes]
+        t = i * frame_sec
+        if vad.is_speech(frame, sample_rate):
+            if span_start is None:
+                span_start = t
+        elif span_start is not None:
+            raw_spans.append((span_start, t))
+            span_start = None
+    if span_start is not None:
+        raw_spans.append((span_start, duration))
+
+    spans = merge_spans(raw_spans, max_gap=min_silence)
+    spans = [(s, e) for s, e in spans if e - s >= min_vocal]
+    spans = merge_spans([(max(0.0, s - padding), min(duration, e + padding)) for s, e in spans])
+    vocal_time = sum(e - s for s, e in spans)
+    logger.info(f"VAD: {len(spans)} vocal spans covering {vocal_time:.1f}s of {duration:.1f}s.")
+    return spans, duration
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import artifact_store  # noqa: E402
+from artifact_store import ArtifactStore, job_path  # noqa: E402
+
+
+def _make_job(store, job_id, size, last_access):
+    os.makedirs(store.path(job_path(job_id, "input")), exist_ok=True)
+    with open(store.path(job_path(job_id, "input", "video.mp4")), "wb") as f:
+        f.write(b"x" * size)
+    store.touch(job_id, timestamp=last_access)
+
+
+def test_gc_evicts_least_recently_used_first(tmp_path):
+    store = ArtifactStore(str(tmp_path), quota_bytes=2500)
+    _make_job(store, "old", 1000, last_access=1.0)
+    _make_job(store, "middle", 1000, last_access=2.0)
+    _make_job(store, "new", 1000, last_access=3.0)
+
+    report = store.gc()
+
+    assert [entry["name"] for entry in report["evicted"]] == ["old"]
+    assert report["reclaimed_bytes"] == 1000
+    assert sorted(os.listdir(store.path("jobs"))) == ["middle", "new"]
+
+
+def test_gc_skips_leased_jobs(tmp_path):
+    store = ArtifactStore(str(tmp_path), quota_bytes=1500)
+    _make_job(store, "old", 1000, last_access=1.0)
+    _make_job(store, "new", 1000, last_access=2.0)
+    store.acquire("old")
+    store.touch("old", timestamp=1.0)
+
+    report = store.gc()
+
+    assert [entry["name"] for entry in report["evicted"]] == ["new"]
+    assert os.path.isdir(store.path(job_path("old")))
+
+
+def test_gc_falls_back_to_mtime_without_access_file(tmp_path):
+    store = ArtifactStore(str(tmp_path), quota_bytes=1500)
+    _make_job(store, "recent", 1000, last_access=time.time())
+    os.makedirs(store.path(job_path("untracked", "input")))
+    with open(store.path(job_path("untracked", "input", "video.mp4")), "wb") as f:
+        f.write(b"x" * 1000)
+    os.utime(store.path(job_path("untracked")), (1.0, 1.0))
+
+    report = store.gc()
+
+    assert [entry["name"] for entry in report["evicted"]] == ["untracked"]
+
+
+def test_gc_leaves_root_files_alone_by_default(tmp_path):
+    store = ArtifactStore(str(tmp_path), quota_bytes=0)
+    _make_job(store, "job", 1000, last_access=1.0)
+    with open(store.path("legacy.mp4"), "wb") as f:
+        f.write(b"x" * 500)
+
+    report = store.gc()
+
+    assert [entry["name"] for entry in report["evicted"]] == ["job"]
+    assert os.path.exists(store.path("legacy.mp4"))
+
+
+def test_gc_dry_run_deletes_nothing(tmp_path):
+    store = ArtifactStore(str(tmp_path), quota_bytes=0)
+    _make_job(store, "job", 1000, last_access=1.0)
+    with open(store.path("legacy.mp4"), "wb") as f:
+        f.write(b"x" * 500)
+
+    report = store.gc(dry_run=True, include_legacy=True)
+
+    assert report["dry_run"]
+    assert report["reclaimed_bytes"] == 1500
+    assert os.path.isdir(store.path(job_path("job")))
+    assert os.path.exists(store.path("legacy.mp4"))
+
+
+def test_gc_skips_entries_that_vanish_mid_scan(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path), quota_bytes=0)
+    with open(store.path("legacy.mp4"), "wb") as f:
+        f.write(b"x" * 500)
+    real_getmtime = os.path.getmtime
+
+    def vanishing_getmtime(path):
+        if path.endswith("legacy.mp4"):
+            raise FileNotFoundError(path)
+        return real_getmtime(path)
+
+    monkeypatch.setattr(artifact_store.os.path, "getmtime", vanishing_getmtime)
+
+    report = store.gc(include_legacy=True)
+
+    assert report["evicted"] == []